@@ -4,62 +4,191 @@ ServicePi IoT API Service
 Provides REST API for IoT device management and sensor data
 """
 
-import os
-import json
-import configparser
-from datetime import datetime
-from flask import Flask, jsonify, request
+import itertools
+import logging
+import queue
+import statistics
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from flask import Flask, Response, g, request
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from settings import CFG
 
 app = Flask(__name__)
+log = logging.getLogger(__name__)
 
-# Load configuration
-config = configparser.ConfigParser()
-config.read('/app/config/config.ini')
-
-# Service configuration
-API_PORT = int(os.getenv('API_PORT', config.get('network', 'api_port', fallback='8080')))
-SERVICE_NAME = config.get('general', 'service_name', fallback='ServicePi IoT')
+# Shared HTTP session so inter-service calls reuse keep-alive connections
+_http = requests.Session()
+_http.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
 
 # In-memory storage for demo (replace with database in production)
-sensor_data = []
+# Bounded ring buffers: numeric history per sensor and the window served by GET
+SENSOR_HISTORY = 10000
+RECENT_READINGS = 100
+recent_sensor_data = deque(maxlen=RECENT_READINGS)
+# Every reading ever received, independent of the bounded buffers
+total_sensor_readings = 0
 device_status = {
     'temperature_sensor': {'status': 'online', 'last_reading': 22.5, 'unit': '°C'},
     'humidity_sensor': {'status': 'online', 'last_reading': 65.2, 'unit': '%'},
     'motion_sensor': {'status': 'online', 'last_reading': False, 'unit': 'boolean'}
 }
+# Numeric values per known sensor type, kept alongside the records for aggregates
+sensor_values = {sensor_type: deque(maxlen=SENSOR_HISTORY) for sensor_type in device_status}
+# Guards recent_sensor_data, total_sensor_readings, sensor_values, device_status and online_devices
+_lock = threading.Lock()
+# Maintained incrementally by _update_device instead of scanning device_status
+online_devices = sum(1 for d in device_status.values() if d['status'] == 'online')
+
+def _update_device(device_id, fields):
+    """Apply fields to a device, keeping the online counter in sync (hold _lock)"""
+    global online_devices
+    device = device_status[device_id]
+    was_online = device.get('status') == 'online'
+    device.update(fields)
+    online_devices += (device.get('status') == 'online') - was_online
+
+def _devices_snapshot():
+    """Copy device_status under the lock so it can be serialized outside it"""
+    with _lock:
+        return {k: dict(v) for k, v in device_status.items()}, online_devices
+
+# Inbound readings are queued by POST and applied in batches by one thread
+INGEST_BATCH_SIZE = 64
+INGEST_BATCH_WINDOW = 0.005  # seconds
+_ingest = queue.Queue()
+
+def _apply_reading(data):
+    """Record one validated reading in shared state (hold _lock)"""
+    global total_sensor_readings
+    # Update device status and numeric history if applicable
+    sensor_type = data.get('sensor_type')
+    value = data.get('value')
+    if sensor_type in device_status:
+        _update_device(sensor_type, {'last_reading': value, 'status': 'online'})
+    if sensor_type in sensor_values and isinstance(value, (int, float)) and not isinstance(value, bool):
+        sensor_values[sensor_type].append(float(value))
+    
+    # Store the record last, so a reading that fails above is not kept
+    recent_sensor_data.append(data)
+    total_sensor_readings += 1
+
+def _aggregate_readings():
+    """Drain queued readings into shared state, one lock acquire per batch"""
+    while True:
+        batch = [_ingest.get()]
+        deadline = time.monotonic() + INGEST_BATCH_WINDOW
+        while len(batch) < INGEST_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_ingest.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        with _lock:
+            for data in batch:
+                # One bad reading must not stop ingestion for everyone else
+                try:
+                    _apply_reading(data)
+                except Exception:
+                    log.exception('Dropping sensor reading %r', data)
+
+threading.Thread(target=_aggregate_readings, name='sensor-aggregator', daemon=True).start()
+
+def _request_json():
+    """Parse the raw request body with orjson, returning None if it is not JSON"""
+    try:
+        return orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError:
+        return None
+
+def _serializable(data):
+    """Check data still serializes when nested as deep as any response embeds it
+
+    orjson parses up to 1024 levels of nesting but only serializes 255, so a
+    body that parses can still break every later response that includes it.
+    """
+    try:
+        orjson.dumps({'devices': {'': {'': data}}})
+    except orjson.JSONEncodeError:
+        return False
+    return True
+
+@app.before_request
+def _ts():
+    """Compute the response timestamp once per request"""
+    # /health serves its own per-second cached body and never reads g.ts
+    if request.endpoint == 'health_check':
+        return
+    g.ts = datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+# Static response bodies, built once with a placeholder for the timestamp
+_TS_PLACEHOLDER = b'__TS__'
+_ROOT_TMPL = orjson.dumps({
+    'service': CFG.service_name,
+    'version': '1.0.0',
+    'timestamp': '__TS__',
+    'endpoints': [
+        '/health',
+        '/api/sensors',
+        '/api/sensors/data',
+        '/api/sensors/<sensor_type>/average',
+        '/api/devices',
+        '/api/system/info'
+    ]
+})
+_HEALTH_TMPL = orjson.dumps({
+    'status': 'healthy',
+    'service': CFG.service_name,
+    'timestamp': '__TS__'
+})
+# (epoch second, body) for /health, rebuilt at most once per second
+_health_cache = (0, b'')
+# The details placeholder is replaced including its quotes by an encoded string
+_DETAILS_PLACEHOLDER = b'"__D__"'
+_COMM_ERROR_TMPL = orjson.dumps({
+    'error': 'Communication failed',
+    'details': '__D__',
+    'timestamp': '__TS__'
+})
+
+def _json(obj, status=200):
+    """Serialize obj with orjson straight into a JSON Response"""
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
+def _render(tmpl):
+    """Splice the request timestamp into a prebuilt JSON body"""
+    return Response(tmpl.replace(_TS_PLACEHOLDER, g.ts.encode()), mimetype='application/json')
 
 @app.route('/', methods=['GET'])
 def root():
     """API root endpoint"""
-    return jsonify({
-        'service': SERVICE_NAME,
-        'version': '1.0.0',
-        'timestamp': datetime.utcnow().isoformat(),
-        'endpoints': [
-            '/health',
-            '/api/sensors',
-            '/api/sensors/data',
-            '/api/devices',
-            '/api/system/info'
-        ]
-    })
+    return _render(_ROOT_TMPL)
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'service': SERVICE_NAME,
-        'timestamp': datetime.utcnow().isoformat()
-    })
+    global _health_cache
+    now = int(time.time())
+    second, body = _health_cache
+    if second != now:
+        ts = datetime.fromtimestamp(now, timezone.utc).isoformat()
+        body = _HEALTH_TMPL.replace(_TS_PLACEHOLDER, ts.encode())
+        _health_cache = (now, body)
+    return Response(body, mimetype='application/json', headers={'Cache-Control': 'no-cache'})
 
 @app.route('/api/sensors', methods=['GET'])
 def get_sensors():
     """Get all sensor information"""
-    return jsonify({
-        'sensors': device_status,
-        'timestamp': datetime.utcnow().isoformat()
+    return _json({
+        'sensors': _devices_snapshot()[0],
+        'timestamp': g.ts
     })
 
 @app.route('/api/sensors/data', methods=['GET', 'POST'])
@@ -67,84 +196,128 @@ def sensor_data_endpoint():
     """Get or post sensor data"""
     if request.method == 'GET':
         # Return recent sensor data
-        return jsonify({
-            'data': sensor_data[-100:],  # Last 100 readings
-            'count': len(sensor_data),
-            'timestamp': datetime.utcnow().isoformat()
-        })
+        with _lock:
+            recent = list(recent_sensor_data)  # Last 100 readings
+            count = total_sensor_readings
+        tail = b'],"count":%d,"timestamp":%b}' % (count, orjson.dumps(g.ts))
+        
+        def generate():
+            # One chunk for all readings: each yield is a separate socket write
+            yield b'{"data":['
+            if recent:
+                yield b','.join(orjson.dumps(reading) for reading in recent)
+            yield tail
+        
+        return Response(generate(), mimetype='application/json')
     
     elif request.method == 'POST':
         # Add new sensor reading
-        data = request.get_json()
+        data = _request_json()
         if not data:
-            return jsonify({'error': 'No data provided'}), 400
+            return _json({'error': 'No data provided'}, 400)
+        if not isinstance(data, dict):
+            return _json({'error': 'Data must be a JSON object'}, 400)
+        if not isinstance(data.get('sensor_type', ''), str):
+            return _json({'error': 'sensor_type must be a string'}, 400)
+        if not _serializable(data):
+            return _json({'error': 'Data is nested too deeply'}, 400)
         
         # Add timestamp if not provided
         if 'timestamp' not in data:
-            data['timestamp'] = datetime.utcnow().isoformat()
+            data['timestamp'] = g.ts
         
-        sensor_data.append(data)
-        
-        # Update device status if applicable
-        if 'sensor_type' in data and data['sensor_type'] in device_status:
-            device_status[data['sensor_type']]['last_reading'] = data.get('value')
-            device_status[data['sensor_type']]['status'] = 'online'
-        
-        return jsonify({'success': True, 'data': data}), 201
+        _ingest.put(data)
+        return _json({'success': True, 'data': data}, 202)
+
+@app.route('/api/sensors/<sensor_type>/average', methods=['GET'])
+def sensor_average(sensor_type):
+    """Get the mean of the last n numeric readings for a sensor"""
+    try:
+        n = int(request.args.get('n', RECENT_READINGS))
+    except ValueError:
+        n = 0
+    if n <= 0:
+        return _json({'error': 'n must be a positive integer'}, 400)
+    
+    with _lock:
+        values = sensor_values.get(sensor_type)
+        if not values:
+            return _json({'error': 'No numeric readings for sensor'}, 404)
+        last = list(itertools.islice(reversed(values), n))
+    
+    return _json({
+        'sensor_type': sensor_type,
+        'average': statistics.fmean(last),
+        'count': len(last),
+        'timestamp': g.ts
+    })
 
 @app.route('/api/devices', methods=['GET'])
 def get_devices():
     """Get all device information"""
-    return jsonify({
-        'devices': device_status,
-        'total_devices': len(device_status),
-        'online_devices': sum(1 for d in device_status.values() if d['status'] == 'online'),
-        'timestamp': datetime.utcnow().isoformat()
+    devices, online = _devices_snapshot()
+    return _json({
+        'devices': devices,
+        'total_devices': len(devices),
+        'online_devices': online,
+        'timestamp': g.ts
     })
 
 @app.route('/api/devices/<device_id>', methods=['GET', 'PUT'])
 def device_endpoint(device_id):
     """Get or update specific device"""
     if device_id not in device_status:
-        return jsonify({'error': 'Device not found'}), 404
+        return _json({'error': 'Device not found'}, 404)
     
     if request.method == 'GET':
-        return jsonify({
+        with _lock:
+            device = dict(device_status[device_id])
+        return _json({
             'device_id': device_id,
-            'device': device_status[device_id],
-            'timestamp': datetime.utcnow().isoformat()
+            'device': device,
+            'timestamp': g.ts
         })
     
     elif request.method == 'PUT':
-        data = request.get_json()
+        data = _request_json()
         if not data:
-            return jsonify({'error': 'No data provided'}), 400
+            return _json({'error': 'No data provided'}, 400)
+        if not isinstance(data, dict):
+            return _json({'error': 'Data must be a JSON object'}, 400)
+        if not _serializable(data):
+            return _json({'error': 'Data is nested too deeply'}, 400)
         
         # Update device status
-        device_status[device_id].update(data)
-        return jsonify({
+        with _lock:
+            _update_device(device_id, data)
+            device = dict(device_status[device_id])
+        return _json({
             'success': True,
             'device_id': device_id,
-            'device': device_status[device_id]
+            'device': device
         })
 
 @app.route('/api/system/info', methods=['GET'])
 def system_info():
     """Get system information"""
-    return jsonify({
+    with _lock:
+        total_readings = total_sensor_readings
+        total_devices = len(device_status)
+        online = online_devices
+    return _json({
         'system': {
-            'service': SERVICE_NAME,
+            'service': CFG.service_name,
             'uptime': 'Running',
             'version': '1.0.0',
-            'api_port': API_PORT,
-            'ssl_enabled': os.getenv('SSL_ENABLED', 'false').lower() == 'true'
+            'api_port': CFG.api_port,
+            'ssl_enabled': CFG.ssl_enabled
         },
         'statistics': {
-            'total_sensor_readings': len(sensor_data),
-            'total_devices': len(device_status),
-            'online_devices': sum(1 for d in device_status.values() if d['status'] == 'online')
+            'total_sensor_readings': total_readings,
+            'total_devices': total_devices,
+            'online_devices': online
         },
-        'timestamp': datetime.utcnow().isoformat()
+        'timestamp': g.ts
     })
 
 @app.route('/api/system/communicate', methods=['POST'])
@@ -152,12 +325,12 @@ def communicate_with_services():
     """Demonstrate inter-service communication"""
     try:
         # Example: Check if web service is healthy
-        web_health = requests.get('http://web-backend:80/health', timeout=5)
+        web_health = _http.get('http://web-backend:80/health', timeout=5)
         
         # Example: Get Portainer status (this would need Portainer API credentials in real use)
         portainer_status = "accessible"  # Simplified for demo
         
-        return jsonify({
+        return _json({
             'service_communication': {
                 'web_backend': {
                     'status': 'healthy' if web_health.status_code == 200 else 'unhealthy',
@@ -167,15 +340,15 @@ def communicate_with_services():
                     'status': portainer_status
                 }
             },
-            'timestamp': datetime.utcnow().isoformat()
+            'timestamp': g.ts
         })
     except Exception as e:
-        return jsonify({
-            'error': 'Communication failed',
-            'details': str(e),
-            'timestamp': datetime.utcnow().isoformat()
-        }), 500
+        # Fill the timestamp first so placeholder text inside the message is left alone
+        body = _COMM_ERROR_TMPL.replace(_TS_PLACEHOLDER, g.ts.encode())
+        body = body.replace(_DETAILS_PLACEHOLDER, orjson.dumps(str(e)))
+        return Response(body, status=500, mimetype='application/json')
 
 if __name__ == '__main__':
-    print(f"Starting {SERVICE_NAME} API on port {API_PORT}")
-    app.run(host='0.0.0.0', port=API_PORT, debug=False)
\ No newline at end of file
+    # Development server only; the container runs the app under gunicorn
+    print(f"Starting {CFG.service_name} API on port {CFG.api_port}")
+    app.run(host='0.0.0.0', port=CFG.api_port, debug=False)
\ No newline at end of file
@@ -0,0 +1,15 @@
+"""
+Gunicorn settings for the ServicePi IoT API
+"""
+
+from settings import CFG
+
+# Bind to the port resolved from config.ini / API_PORT
+bind = f'0.0.0.0:{CFG.api_port}'
+
+# Single gevent worker: sensor and device state live in process memory,
+# so one worker multiplexes connections instead of forking copies of it
+worker_class = 'gevent'
+workers = 1
+worker_connections = 1000
+keepalive = 5
@@ -0,0 +1,27 @@
+"""
+ServicePi IoT service settings
+Resolved once from config.ini and environment overrides
+"""
+
+import os
+import configparser
+from dataclasses import dataclass
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Service configuration, resolved once at import"""
+    api_port: int
+    service_name: str
+    ssl_enabled: bool
+
+def load_config(path='/app/config/config.ini'):
+    """Read config.ini and environment overrides into a Config"""
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    return Config(
+        api_port=int(os.getenv('API_PORT', parser.get('network', 'api_port', fallback='8080'))),
+        service_name=parser.get('general', 'service_name', fallback='ServicePi IoT'),
+        ssl_enabled=os.getenv('SSL_ENABLED', 'false').lower() == 'true'
+    )
+
+CFG = load_config()